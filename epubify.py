@@ -2,18 +2,26 @@
 from __future__ import annotations
 
 import argparse
+import codecs
 import datetime as dt
 import html
 import os
 from pathlib import Path
 import re
+import string
 import sys
+import time
 import uuid
 import zipfile
 from dataclasses import dataclass, field
-from typing import Iterable, Optional
+from itertools import chain, islice
+from typing import Iterable, Iterator, Optional, Union
 
-ENCODING_CANDIDATES = ("utf-8-sig", "utf-8", "gb18030")
+ENCODING_SNIFF_BYTES = 4096
+
+DEFAULT_COMPRESSLEVEL = 6
+FAST_COMPRESSLEVEL = 1
+SMALL_COMPRESSLEVEL = 9
 
 LABEL_RE = re.compile(
     r"^\s*(书名|作者|作\s*者|内容简介|简介|内容介绍|文案)\s*[:：]\s*(.*)\s*$"
@@ -21,19 +29,6 @@ LABEL_RE = re.compile(
 
 TITLE_ONLY_RE = re.compile(r"^《(.+)》$")
 
-CHAPTER_PATTERNS = [
-    re.compile(r"^第\s*[0-9一二三四五六七八九十百千万两零〇]+\s*章.*$"),
-    re.compile(r"^第\s*[0-9一二三四五六七八九十百千万两零〇]+\s*节.*$"),
-    re.compile(r"^第\s*[0-9一二三四五六七八九十百千万两零〇]+\s*回.*$"),
-    re.compile(r"^Chapter\s+\d+.*$", re.IGNORECASE),
-]
-
-VOLUME_PATTERNS = [
-    re.compile(r"^第\s*[0-9一二三四五六七八九十百千万两零〇]+\s*卷.*$"),
-    re.compile(r"^卷\s*[0-9一二三四五六七八九十百千万两零〇]+.*$"),
-    re.compile(r"^第\s*[0-9一二三四五六七八九十百千万两零〇]+\s*部.*$"),
-]
-
 SPECIAL_HEADINGS = [
     "序章",
     "序",
@@ -54,12 +49,142 @@ SPECIAL_HEADINGS = [
     "完结感言",
 ]
 
-SKIP_CANDIDATE_RE = re.compile(r"(http|www|QQ群|群|公众号|微信|下载|txt|整理|校对|打包|本书|电子书)")
+HEADING_NUMERAL = r"[0-9一二三四五六七八九十百千万两零〇]+"
+
+CHAPTER_RE = re.compile(
+    rf"^(?:第\s*{HEADING_NUMERAL}\s*[章节回]|Chapter\s+\d+"
+    rf"|(?:{'|'.join(map(re.escape, SPECIAL_HEADINGS))})(?:[ :：]|$))",
+    re.IGNORECASE,
+)
+
+VOLUME_RE = re.compile(rf"^(?:第\s*{HEADING_NUMERAL}\s*[卷部]|卷\s*{HEADING_NUMERAL})")
+
+HEADING_FIRST_CHARS = frozenset("第卷Cc" + "".join(kw[0] for kw in SPECIAL_HEADINGS))
+
+SKIP_KEYWORDS = (
+    "http",
+    "www",
+    "QQ群",
+    "群",
+    "公众号",
+    "微信",
+    "下载",
+    "txt",
+    "整理",
+    "校对",
+    "打包",
+    "本书",
+    "电子书",
+)
 SENTENCE_END_RE = re.compile(r"[。！？]$")
-COMMA_RE = re.compile(r"[，,]")
 HEADING_MAX_LEN = 40
 HEADING_MAX_COMMAS = 1
 
+KIND_VOLUME = 0
+KIND_CHAPTER = 1
+KIND_FRONT = 2
+
+SECTION_HEADER_TEMPLATE = (
+    "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
+    "<html xmlns=\"http://www.w3.org/1999/xhtml\" xml:lang=\"{lang}\">\n"
+    "  <head>\n"
+    "    <meta charset=\"utf-8\" />\n"
+    "    <title>{title}</title>\n"
+    "    <link rel=\"stylesheet\" type=\"text/css\" href=\"../style.css\" />\n"
+    "  </head>\n"
+    "  <body>\n"
+    "    <h2>{title}</h2>\n"
+)
+
+SECTION_HEADER_PARTS = tuple(
+    (literal, field_name) for literal, field_name, _, _ in string.Formatter().parse(SECTION_HEADER_TEMPLATE)
+)
+SECTION_FOOTER = "  </body>\n</html>\n"
+SECTION_WRITE_BATCH = 256
+
+FRONT_MATTER_TEMPLATE = (
+    "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
+    "<html xmlns=\"http://www.w3.org/1999/xhtml\" xml:lang=\"{lang}\">\n"
+    "  <head>\n"
+    "    <meta charset=\"utf-8\" />\n"
+    "    <title>{title}</title>\n"
+    "    <link rel=\"stylesheet\" type=\"text/css\" href=\"../style.css\" />\n"
+    "  </head>\n"
+    "  <body class=\"front-matter\">\n"
+    "    <h1>{title}</h1>\n"
+    "{body}\n"
+    "  </body>\n"
+    "</html>\n"
+)
+
+NAV_TEMPLATE = (
+    "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
+    "<html xmlns=\"http://www.w3.org/1999/xhtml\" xmlns:epub=\"http://www.idpf.org/2007/ops\" "
+    "xml:lang=\"{lang}\">\n"
+    "  <head>\n"
+    "    <meta charset=\"utf-8\" />\n"
+    "    <title>目录</title>\n"
+    "    <link rel=\"stylesheet\" type=\"text/css\" href=\"style.css\" />\n"
+    "  </head>\n"
+    "  <body>\n"
+    "    <nav epub:type=\"toc\" id=\"toc\">\n"
+    "      <h1>目录</h1>\n"
+    "{toc}\n"
+    "    </nav>\n"
+    "    <nav epub:type=\"landmarks\">\n"
+    "      <h2>Landmarks</h2>\n"
+    "      <ol>\n"
+    "        <li><a epub:type=\"bodymatter\" href=\"{first_href}\">正文</a></li>\n"
+    "      </ol>\n"
+    "    </nav>\n"
+    "  </body>\n"
+    "</html>\n"
+)
+
+CONTENT_OPF_TEMPLATE = (
+    "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
+    "<package xmlns=\"http://www.idpf.org/2007/opf\" unique-identifier=\"bookid\" version=\"3.0\">\n"
+    "  <metadata xmlns:dc=\"http://purl.org/dc/elements/1.1/\">\n"
+    "    {metadata}\n"
+    "  </metadata>\n"
+    "  <manifest>\n"
+    "    {manifest}\n"
+    "  </manifest>\n"
+    "  <spine toc=\"ncx\">\n"
+    "    {spine}\n"
+    "  </spine>\n"
+    "</package>\n"
+)
+
+TOC_NCX_TEMPLATE = (
+    "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
+    "<ncx xmlns=\"http://www.daisy.org/z3986/2005/ncx/\" version=\"2005-1\">\n"
+    "  <head>\n"
+    "    <meta name=\"dtb:uid\" content=\"{book_id}\" />\n"
+    "  </head>\n"
+    "  <docTitle><text>{title}</text></docTitle>\n"
+    "  <navMap>\n"
+    "    {nav_points}\n"
+    "  </navMap>\n"
+    "</ncx>\n"
+)
+
+STYLE_CSS = (
+    "p { text-indent: 2em; margin: 0 0 0.8em; }\n"
+    "h2 { font-weight: bold; font-size: 1.2em; margin: 1.5em 0 1em; }\n"
+    ".front-matter p.author { text-align: center; text-indent: 0; margin: 0 0 1.5em; }\n"
+    ".front-matter p.intro-label { text-indent: 0; font-weight: bold; margin: 1.2em 0 0.6em; }\n"
+)
+
+CONTAINER_XML = (
+    "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
+    "<container version=\"1.0\" xmlns=\"urn:oasis:names:tc:opendocument:xmlns:container\">\n"
+    "  <rootfiles>\n"
+    "    <rootfile full-path=\"OEBPS/content.opf\" media-type=\"application/oebps-package+xml\" />\n"
+    "  </rootfiles>\n"
+    "</container>\n"
+)
+
 
 @dataclass
 class Chapter:
@@ -95,12 +220,23 @@ class Book:
     intro: Optional[str]
     volumes: list[Volume] = field(default_factory=list)
     root_chapters: list[Chapter] = field(default_factory=list)
-    spine: list[object] = field(default_factory=list)
+    spine: list[tuple[int, object]] = field(default_factory=list)
+
+
+def sniff_encoding(prefix: bytes) -> str:
+    if prefix.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(prefix)
+    except UnicodeDecodeError:
+        return "gb18030"
+    return "utf-8"
 
 
 def read_text(path: Path) -> str:
     data = path.read_bytes()
-    for enc in ENCODING_CANDIDATES:
+    encoding = sniff_encoding(data[:ENCODING_SNIFF_BYTES])
+    for enc in dict.fromkeys((encoding, "gb18030")):
         try:
             return data.decode(enc)
         except UnicodeDecodeError:
@@ -108,10 +244,6 @@ def read_text(path: Path) -> str:
     return data.decode("utf-8", errors="replace")
 
 
-def is_heading(line: str, prev_line: Optional[str] = None, next_line: Optional[str] = None) -> bool:
-    return classify_heading(line, prev_line, next_line) is not None
-
-
 def is_likely_heading_line(line: str, prev_line: Optional[str], next_line: Optional[str]) -> bool:
     s = line.strip()
     if not s:
@@ -127,7 +259,7 @@ def is_likely_heading_line(line: str, prev_line: Optional[str], next_line: Optio
     if len(s) > HEADING_MAX_LEN and not isolated:
         return False
 
-    if len(COMMA_RE.findall(s)) > HEADING_MAX_COMMAS and not isolated:
+    if not isolated and s.count(",") + s.count("，") > HEADING_MAX_COMMAS:
         return False
 
     return True
@@ -135,62 +267,43 @@ def is_likely_heading_line(line: str, prev_line: Optional[str], next_line: Optio
 
 def classify_heading(line: str, prev_line: Optional[str] = None, next_line: Optional[str] = None) -> Optional[str]:
     s = line.strip()
-    if not s:
+    if s[:1] not in HEADING_FIRST_CHARS:
         return None
-    for pattern in CHAPTER_PATTERNS:
-        if pattern.match(s):
-            return "chapter" if is_likely_heading_line(line, prev_line, next_line) else None
-    for kw in SPECIAL_HEADINGS:
-        if s == kw or s.startswith(kw + " ") or s.startswith(kw + "：") or s.startswith(kw + ":"):
-            return "chapter" if is_likely_heading_line(line, prev_line, next_line) else None
-    for pattern in VOLUME_PATTERNS:
-        if pattern.match(s):
-            return "volume" if is_likely_heading_line(line, prev_line, next_line) else None
+    if CHAPTER_RE.match(s):
+        return "chapter" if is_likely_heading_line(line, prev_line, next_line) else None
+    if VOLUME_RE.match(s):
+        return "volume" if is_likely_heading_line(line, prev_line, next_line) else None
     return None
 
 
-def parse_metadata(lines: list[str]) -> tuple[Optional[str], Optional[str], Optional[str], set[int]]:
+def parse_metadata(lines: list[str], scan_limit: int) -> tuple[Optional[str], Optional[str], Optional[str], bytearray]:
     title = None
     author = None
     intro_lines: list[str] = []
-    skip_idx: set[int] = set()
+    skip = bytearray(scan_limit)
     candidates: list[tuple[int, str]] = []
     pending_label: Optional[str] = None
     in_intro = False
 
-    first_heading_idx = None
-    for i, line in enumerate(lines):
-        prev_line = lines[i - 1] if i > 0 else None
-        next_line = lines[i + 1] if i + 1 < len(lines) else None
-        if is_heading(line, prev_line, next_line):
-            first_heading_idx = i
-            break
-
-    scan_limit = first_heading_idx if first_heading_idx is not None else len(lines)
     non_empty_seen = 0
 
     for i in range(scan_limit):
-        raw = lines[i]
-        prev_line = lines[i - 1] if i > 0 else None
-        next_line = lines[i + 1] if i + 1 < len(lines) else None
-        s = raw.strip()
+        s = lines[i].strip()
         if not s:
             if in_intro and intro_lines:
                 in_intro = False
             continue
 
         if in_intro:
-            if is_heading(raw, prev_line, next_line):
-                break
             intro_lines.append(s)
-            skip_idx.add(i)
+            skip[i] = 1
             continue
 
         m = LABEL_RE.match(s)
         if m:
             label = m.group(1)
             value = m.group(2).strip()
-            skip_idx.add(i)
+            skip[i] = 1
             if label in ("书名",):
                 if value:
                     title = value
@@ -209,20 +322,20 @@ def parse_metadata(lines: list[str]) -> tuple[Optional[str], Optional[str], Opti
 
         if s in ("书名", "书 名"):
             pending_label = "title"
-            skip_idx.add(i)
+            skip[i] = 1
             continue
         if s in ("作者", "作 者"):
             pending_label = "author"
-            skip_idx.add(i)
+            skip[i] = 1
             continue
         if s in ("内容简介", "简介", "内容介绍", "文案"):
             in_intro = True
-            skip_idx.add(i)
+            skip[i] = 1
             continue
 
         if pending_label and (s.startswith("：") or s.startswith(":")):
             value = s[1:].strip()
-            skip_idx.add(i)
+            skip[i] = 1
             if pending_label == "title" and value:
                 title = value
             elif pending_label == "author" and value:
@@ -233,44 +346,36 @@ def parse_metadata(lines: list[str]) -> tuple[Optional[str], Optional[str], Opti
         m_title_only = TITLE_ONLY_RE.match(s)
         if m_title_only and title is None:
             title = m_title_only.group(1).strip()
-            skip_idx.add(i)
+            skip[i] = 1
             continue
 
         non_empty_seen += 1
-        if non_empty_seen <= 6 and not SKIP_CANDIDATE_RE.search(s):
+        if non_empty_seen <= 6 and not any(kw in s for kw in SKIP_KEYWORDS):
             candidates.append((i, s))
 
     if title is None and candidates:
         idx, value = candidates[0]
         title = value
-        skip_idx.add(idx)
+        skip[idx] = 1
 
     if author is None and len(candidates) >= 2:
         idx, value = candidates[1]
         if value != title:
             author = value
-            skip_idx.add(idx)
+            skip[idx] = 1
 
     intro = "\n".join(intro_lines).strip() if intro_lines else None
-    return title, author, intro, skip_idx
+    return title, author, intro, skip
 
 
 def normalize_content_line(line: str) -> str:
-    s = line.strip()
-    if not s:
-        return ""
-    return s.replace("\u3000", "")
+    return line.strip().replace("\u3000", "")
 
 
 def parse_book(text: str, source_name: str) -> Book:
     lines = text.splitlines()
-    title, author, intro, skip_idx = parse_metadata(lines)
-
-    body_lines = [line for idx, line in enumerate(lines) if idx not in skip_idx]
-    while body_lines and not body_lines[0].strip():
-        body_lines.pop(0)
-
-    book = Book(title=title or source_name, author=author, intro=intro)
+    book = Book(title=source_name, author=None, intro=None)
+    in_front = True
 
     current_volume: Optional[Volume] = None
     current_chapter: Optional[Chapter] = None
@@ -278,7 +383,7 @@ def parse_book(text: str, source_name: str) -> Book:
     def start_volume(heading: str) -> Volume:
         vol = Volume(title=heading)
         book.volumes.append(vol)
-        book.spine.append(vol)
+        book.spine.append((KIND_VOLUME, vol))
         return vol
 
     def start_chapter(heading: str, volume: Optional[Volume]) -> Chapter:
@@ -287,24 +392,22 @@ def parse_book(text: str, source_name: str) -> Book:
             volume.chapters.append(chap)
         else:
             book.root_chapters.append(chap)
-        book.spine.append(chap)
+        book.spine.append((KIND_CHAPTER, chap))
         return chap
 
-    for idx, line in enumerate(body_lines):
-        prev_line = body_lines[idx - 1] if idx > 0 else None
-        next_line = body_lines[idx + 1] if idx + 1 < len(body_lines) else None
-        heading_type = classify_heading(line, prev_line, next_line)
+    def add_line(line: str, heading_type: Optional[str]) -> None:
+        nonlocal current_volume, current_chapter
         if heading_type == "volume":
             current_chapter = None
             current_volume = start_volume(line.strip())
-            continue
+            return
         if heading_type == "chapter":
             current_chapter = start_chapter(line.strip(), current_volume)
-            continue
+            return
 
         content = normalize_content_line(line)
         if not content:
-            continue
+            return
 
         if current_chapter:
             current_chapter.lines.append(content)
@@ -317,6 +420,32 @@ def parse_book(text: str, source_name: str) -> Book:
                 current_chapter = book.root_chapters[-1]
             current_chapter.lines.append(content)
 
+    def finish_front(scan_limit: int) -> None:
+        nonlocal in_front
+        in_front = False
+        title, author, intro, skip = parse_metadata(lines, scan_limit)
+        book.title = title or source_name
+        book.author = author
+        book.intro = intro
+        kept = [line for line, skipped in zip(lines, skip) if not skipped]
+        following = lines[scan_limit] if scan_limit < len(lines) else None
+        triples = zip(chain((None,), kept), kept, chain(islice(kept, 1, None), (following,)))
+        for prev_line, line, next_line in triples:
+            add_line(line, classify_heading(line, prev_line, next_line))
+
+    triples = zip(chain((None,), lines), lines, chain(islice(lines, 1, None), (None,)))
+    for idx, (prev_line, line, next_line) in enumerate(triples):
+        heading_type = classify_heading(line, prev_line, next_line)
+        if in_front:
+            if heading_type is None:
+                continue
+            finish_front(idx)
+
+        add_line(line, heading_type)
+
+    if in_front:
+        finish_front(len(lines))
+
     return book
 
 
@@ -324,55 +453,64 @@ def build_nav_items(book: Book) -> list[dict]:
     items: list[dict] = []
     current_volume_item: Optional[dict] = None
 
-    for section in book.spine:
-        if isinstance(section, Volume):
-            volume_item = {"title": section.title, "href": section.file_name, "children": []}
-            items.append(volume_item)
-            current_volume_item = volume_item
+    for order, (kind, section) in enumerate(book.spine, start=1):
+        item = {"title": section.title, "href": section.file_name, "order": order, "children": []}
+        if kind == KIND_VOLUME:
+            items.append(item)
+            current_volume_item = item
+        elif section.volume is not None and current_volume_item is not None:
+            current_volume_item["children"].append(item)
         else:
-            chapter_item = {"title": section.title, "href": section.file_name, "children": []}
-            if section.volume is not None and current_volume_item is not None:
-                current_volume_item["children"].append(chapter_item)
-            else:
-                items.append(chapter_item)
+            items.append(item)
     return items
 
 
 def render_nav_list(items: Iterable[dict], indent: str = "  ") -> str:
-    lines = [f"{indent}<ol>"]
-    for item in items:
-        lines.append(f"{indent}  <li><a href=\"{html.escape(item['href'])}\">{html.escape(item['title'])}</a>")
-        if item["children"]:
-            lines.append(render_nav_list(item["children"], indent + "    "))
-            lines.append(f"{indent}  </li>")
-        else:
-            lines.append(f"{indent}  </li>")
-    lines.append(f"{indent}</ol>")
-    return "\n".join(lines)
+    out: list[str] = []
+    _emit_nav_list(items, indent, out)
+    return "\n".join(out)
 
 
-def render_section(title: str, lines: list[str], lang: str) -> str:
-    paragraphs = []
-    for line in lines:
-        if not line:
-            continue
-        paragraphs.append(f"    <p>{html.escape(line)}</p>")
-
-    body = "\n".join(paragraphs) if paragraphs else ""
-    return (
-        "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
-        "<html xmlns=\"http://www.w3.org/1999/xhtml\" xml:lang=\"{lang}\">\n"
-        "  <head>\n"
-        "    <meta charset=\"utf-8\" />\n"
-        "    <title>{title}</title>\n"
-        "    <link rel=\"stylesheet\" type=\"text/css\" href=\"../style.css\" />\n"
-        "  </head>\n"
-        "  <body>\n"
-        "    <h2>{title}</h2>\n"
-        "{body}\n"
-        "  </body>\n"
-        "</html>\n"
-    ).format(lang=lang, title=html.escape(title), body=body)
+def _emit_nav_list(items: Iterable[dict], indent: str, out: list[str]) -> None:
+    out.append(f"{indent}<ol>")
+    for item in items:
+        out.append(f"{indent}  <li><a href=\"{html.escape(item['href'])}\">{html.escape(item['title'])}</a>")
+        if item["children"]:
+            _emit_nav_list(item["children"], indent + "    ", out)
+        out.append(f"{indent}  </li>")
+    out.append(f"{indent}</ol>")
+
+
+def render_nav_points(items: Iterable[dict]) -> str:
+    out: list[str] = []
+    for top in items:
+        if out:
+            out.append("\n    ")
+        stack: list[tuple[dict, bool]] = [(top, False)]
+        while stack:
+            item, closing = stack.pop()
+            if closing:
+                out.append("</navPoint>")
+                continue
+            out.append(
+                f"<navPoint id=\"navPoint-{item['order']}\" playOrder=\"{item['order']}\">"
+                f"<navLabel><text>{html.escape(item['title'])}</text></navLabel>"
+                f"<content src=\"{html.escape(item['href'])}\"/>"
+            )
+            stack.append((item, True))
+            stack.extend((child, False) for child in reversed(item["children"]))
+    return "".join(out)
+
+
+def iter_section_bytes(section: Union[Chapter, Volume], lang: str) -> Iterator[bytes]:
+    fields = {"lang": lang, "title": html.escape(section.title)}
+    yield "".join(
+        literal + fields[field_name] if field_name else literal for literal, field_name in SECTION_HEADER_PARTS
+    ).encode("utf-8")
+    paragraphs = (f"    <p>{html.escape(line)}</p>\n" for line in section.lines if line)
+    while batch := "".join(islice(paragraphs, SECTION_WRITE_BATCH)):
+        yield batch.encode("utf-8")
+    yield SECTION_FOOTER.encode("utf-8")
 
 
 def render_front_matter(front: FrontMatter, lang: str) -> str:
@@ -381,30 +519,15 @@ def render_front_matter(front: FrontMatter, lang: str) -> str:
         paragraphs.append(f"    <p class=\"author\">作者：{html.escape(front.author)}</p>")
     if front.intro:
         paragraphs.append("    <p class=\"intro-label\">简介</p>")
-        for raw in front.intro.splitlines():
-            line = raw.strip()
-            if not line:
-                continue
-            paragraphs.append(f"    <p>{html.escape(line)}</p>")
-
-    body = "\n".join(paragraphs) if paragraphs else ""
-    return (
-        "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
-        "<html xmlns=\"http://www.w3.org/1999/xhtml\" xml:lang=\"{lang}\">\n"
-        "  <head>\n"
-        "    <meta charset=\"utf-8\" />\n"
-        "    <title>{title}</title>\n"
-        "    <link rel=\"stylesheet\" type=\"text/css\" href=\"../style.css\" />\n"
-        "  </head>\n"
-        "  <body class=\"front-matter\">\n"
-        "    <h1>{title}</h1>\n"
-        "{body}\n"
-        "  </body>\n"
-        "</html>\n"
-    ).format(lang=lang, title=html.escape(front.title), body=body)
-
-
-def build_epub(book: Book, output_path: Path) -> None:
+        paragraphs.extend(
+            f"    <p>{html.escape(line)}</p>" for line in map(str.strip, front.intro.splitlines()) if line
+        )
+
+    body = "\n".join(paragraphs)
+    return FRONT_MATTER_TEMPLATE.format(lang=lang, title=html.escape(front.title), body=body)
+
+
+def build_epub(book: Book, output_path: Path, compresslevel: int = DEFAULT_COMPRESSLEVEL) -> None:
     lang = "zh-CN"
     book_id = f"urn:uuid:{uuid.uuid4()}"
     modified = (
@@ -418,47 +541,21 @@ def build_epub(book: Book, output_path: Path) -> None:
     if book.title or book.author or book.intro:
         front_matter = FrontMatter(title=book.title, author=book.author, intro=book.intro)
 
-    spine_sections: list[object] = []
+    section_files: list[tuple[int, object]] = []
     if front_matter:
-        spine_sections.append(front_matter)
-    spine_sections.extend(book.spine)
+        section_files.append((KIND_FRONT, front_matter))
+    section_files.extend(book.spine)
 
-    section_files: list[object] = []
-    for idx, section in enumerate(spine_sections, start=1):
-        file_name = f"text/section_{idx:04d}.xhtml"
-        item_id = f"section_{idx:04d}"
-        section.file_name = file_name
-        section.item_id = item_id
-        section_files.append(section)
+    for idx, (_, section) in enumerate(section_files, start=1):
+        section.file_name = f"text/section_{idx:04d}.xhtml"
+        section.item_id = f"section_{idx:04d}"
 
     nav_items = build_nav_items(book)
 
-    nav_doc = (
-        "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
-        "<html xmlns=\"http://www.w3.org/1999/xhtml\" xmlns:epub=\"http://www.idpf.org/2007/ops\" "
-        "xml:lang=\"{lang}\">\n"
-        "  <head>\n"
-        "    <meta charset=\"utf-8\" />\n"
-        "    <title>目录</title>\n"
-        "    <link rel=\"stylesheet\" type=\"text/css\" href=\"style.css\" />\n"
-        "  </head>\n"
-        "  <body>\n"
-        "    <nav epub:type=\"toc\" id=\"toc\">\n"
-        "      <h1>目录</h1>\n"
-        "{toc}\n"
-        "    </nav>\n"
-        "    <nav epub:type=\"landmarks\">\n"
-        "      <h2>Landmarks</h2>\n"
-        "      <ol>\n"
-        "        <li><a epub:type=\"bodymatter\" href=\"{first_href}\">正文</a></li>\n"
-        "      </ol>\n"
-        "    </nav>\n"
-        "  </body>\n"
-        "</html>\n"
-    ).format(
+    nav_doc = NAV_TEMPLATE.format(
         lang=lang,
         toc=render_nav_list(nav_items, "      "),
-        first_href=html.escape(section_files[0].file_name) if section_files else "",
+        first_href=html.escape(section_files[0][1].file_name) if section_files else "",
     )
 
     manifest_items = [
@@ -468,7 +565,7 @@ def build_epub(book: Book, output_path: Path) -> None:
     ]
 
     spine_items: list[str] = []
-    for section in section_files:
+    for _, section in section_files:
         manifest_items.append(
             f'<item id="{section.item_id}" href="{section.file_name}" media-type="application/xhtml+xml"/>'
         )
@@ -485,90 +582,50 @@ def build_epub(book: Book, output_path: Path) -> None:
         metadata_lines.append(f'<dc:description>{html.escape(book.intro)}</dc:description>')
     metadata_lines.append(f'<meta property="dcterms:modified">{modified}</meta>')
 
-    content_opf = (
-        "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
-        "<package xmlns=\"http://www.idpf.org/2007/opf\" unique-identifier=\"bookid\" version=\"3.0\">\n"
-        "  <metadata xmlns:dc=\"http://purl.org/dc/elements/1.1/\">\n"
-        "    {metadata}\n"
-        "  </metadata>\n"
-        "  <manifest>\n"
-        "    {manifest}\n"
-        "  </manifest>\n"
-        "  <spine toc=\"ncx\">\n"
-        "    {spine}\n"
-        "  </spine>\n"
-        "</package>\n"
-    ).format(
+    content_opf = CONTENT_OPF_TEMPLATE.format(
         metadata="\n    ".join(metadata_lines),
         manifest="\n    ".join(manifest_items),
         spine="\n    ".join(spine_items),
     )
 
-    nav_points = []
-    play_order = 1
-
-    def add_nav_point(item: dict, depth: int = 1) -> str:
-        nonlocal play_order
-        current_order = play_order
-        play_order += 1
-        children = "".join(add_nav_point(child, depth + 1) for child in item["children"])
-        return (
-            f"<navPoint id=\"navPoint-{current_order}\" playOrder=\"{current_order}\">"
-            f"<navLabel><text>{html.escape(item['title'])}</text></navLabel>"
-            f"<content src=\"{html.escape(item['href'])}\"/>"
-            f"{children}"
-            f"</navPoint>"
-        )
-
-    for item in nav_items:
-        nav_points.append(add_nav_point(item))
-
-    toc_ncx = (
-        "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
-        "<ncx xmlns=\"http://www.daisy.org/z3986/2005/ncx/\" version=\"2005-1\">\n"
-        "  <head>\n"
-        "    <meta name=\"dtb:uid\" content=\"{book_id}\" />\n"
-        "  </head>\n"
-        "  <docTitle><text>{title}</text></docTitle>\n"
-        "  <navMap>\n"
-        "    {nav_points}\n"
-        "  </navMap>\n"
-        "</ncx>\n"
-    ).format(book_id=html.escape(book_id), title=html.escape(book.title), nav_points="\n    ".join(nav_points))
-
-    css = (
-        "p { text-indent: 2em; margin: 0 0 0.8em; }\n"
-        "h2 { font-weight: bold; font-size: 1.2em; margin: 1.5em 0 1em; }\n"
-        ".front-matter p.author { text-align: center; text-indent: 0; margin: 0 0 1.5em; }\n"
-        ".front-matter p.intro-label { text-indent: 0; font-weight: bold; margin: 1.2em 0 0.6em; }\n"
-    )
-
-    container_xml = (
-        "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
-        "<container version=\"1.0\" xmlns=\"urn:oasis:names:tc:opendocument:xmlns:container\">\n"
-        "  <rootfiles>\n"
-        "    <rootfile full-path=\"OEBPS/content.opf\" media-type=\"application/oebps-package+xml\" />\n"
-        "  </rootfiles>\n"
-        "</container>\n"
+    toc_ncx = TOC_NCX_TEMPLATE.format(
+        book_id=html.escape(book_id),
+        title=html.escape(book.title),
+        nav_points=render_nav_points(nav_items),
     )
 
-    with zipfile.ZipFile(output_path, "w") as zf:
-        mimetype_info = zipfile.ZipInfo("mimetype")
-        mimetype_info.compress_type = zipfile.ZIP_STORED
-        zf.writestr(mimetype_info, "application/epub+zip")
+    date_time = time.localtime()[:6]
 
-        zf.writestr("META-INF/container.xml", container_xml)
-        zf.writestr("OEBPS/content.opf", content_opf)
-        zf.writestr("OEBPS/nav.xhtml", nav_doc)
-        zf.writestr("OEBPS/style.css", css)
-        zf.writestr("OEBPS/toc.ncx", toc_ncx)
-
-        for section in section_files:
-            if isinstance(section, FrontMatter):
-                content = render_front_matter(section, lang)
-            else:
-                content = render_section(section.title, section.lines, lang)
-            zf.writestr(f"OEBPS/{section.file_name}", content)
+    def zip_info(name: str, compress_type: int = zipfile.ZIP_DEFLATED) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(name, date_time=date_time)
+        info.compress_type = compress_type
+        # ZipFile.open(name, "w") ignores the archive's level, so set it here.
+        # Python 3.13 renamed the private _compresslevel to compress_level.
+        if sys.version_info >= (3, 13):
+            info.compress_level = compresslevel
+        else:
+            info._compresslevel = compresslevel
+        info.external_attr = 0o600 << 16
+        return info
+
+    with zipfile.ZipFile(
+        output_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel, allowZip64=False
+    ) as zf:
+        zf.writestr(zip_info("mimetype", zipfile.ZIP_STORED), "application/epub+zip")
+
+        zf.writestr(zip_info("META-INF/container.xml"), CONTAINER_XML)
+        zf.writestr(zip_info("OEBPS/content.opf"), content_opf)
+        zf.writestr(zip_info("OEBPS/nav.xhtml"), nav_doc)
+        zf.writestr(zip_info("OEBPS/style.css"), STYLE_CSS)
+        zf.writestr(zip_info("OEBPS/toc.ncx"), toc_ncx)
+
+        for kind, section in section_files:
+            if kind == KIND_FRONT:
+                zf.writestr(zip_info(f"OEBPS/{section.file_name}"), render_front_matter(section, lang))
+                continue
+            with zf.open(zip_info(f"OEBPS/{section.file_name}"), "w") as fp:
+                for chunk in iter_section_bytes(section, lang):
+                    fp.write(chunk)
 
 
 def parse_args(argv: list[str]) -> argparse.Namespace:
@@ -577,6 +634,22 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
     )
     parser.add_argument("input", help="Input TXT file path")
     parser.add_argument("-o", "--output", help="Output EPUB file path")
+    level = parser.add_mutually_exclusive_group()
+    level.add_argument(
+        "--fast",
+        dest="compresslevel",
+        action="store_const",
+        const=FAST_COMPRESSLEVEL,
+        help="Compress quickly at the cost of a larger file",
+    )
+    level.add_argument(
+        "--small",
+        dest="compresslevel",
+        action="store_const",
+        const=SMALL_COMPRESSLEVEL,
+        help="Compress harder for a smaller file",
+    )
+    parser.set_defaults(compresslevel=DEFAULT_COMPRESSLEVEL)
     return parser.parse_args(argv)
 
 
@@ -591,7 +664,7 @@ def main(argv: list[str]) -> int:
 
     text = read_text(input_path)
     book = parse_book(text, input_path.stem)
-    build_epub(book, output_path)
+    build_epub(book, output_path, args.compresslevel)
     print(f"EPUB saved to: {output_path}")
     return 0
 
@@ -1,3 +1,4 @@
+import codecs
 import io
 import tempfile
 import unittest
@@ -48,6 +49,33 @@ class TestEpubify(unittest.TestCase):
         self.assertEqual(len(volume.chapters), 2)
         self.assertEqual(volume.chapters[1].title, "第二章 章二")
 
+    def test_special_headings(self):
+        for line in ("序章", "序 一", "楔子：起", "番外篇:二", "完结感言"):
+            self.assertEqual(epubify.classify_heading(line), "chapter", line)
+        for line in ("序言", "番外一", "后记里写着"):
+            self.assertIsNone(epubify.classify_heading(line), line)
+
+    def test_leading_blank_lines_ignored(self):
+        text = "\n" * 200 + "　　\n \n书名：空行测试\n作者：某人\n\n\n第一章 开始\n第一行\n"
+        book = epubify.parse_book(text, "fallback")
+        self.assertEqual(book.title, "空行测试")
+        self.assertEqual(book.author, "某人")
+        self.assertEqual(len(book.root_chapters), 1)
+        self.assertEqual(book.root_chapters[0].lines, ["第一行"])
+
+    def test_heading_right_after_labels(self):
+        text = "书名：江湖\n作者：某人\n第一章 少年，剑，江湖\n正文第一段。\n正文第二段。\n\n第二章 再会\n内容\n"
+        book = epubify.parse_book(text, "fallback")
+        self.assertEqual([c.title for c in book.root_chapters], ["第一章 少年，剑，江湖", "第二章 再会"])
+        self.assertEqual(book.root_chapters[0].lines, ["正文第一段。", "正文第二段。"])
+
+    def test_heading_after_labels_without_later_heading(self):
+        text = "书名：江湖\n作者：某人\n第一章 他走了。\n正文第一段。\n正文第二段。\n"
+        book = epubify.parse_book(text, "fallback")
+        self.assertEqual(len(book.root_chapters), 1)
+        self.assertEqual(book.root_chapters[0].title, "第一章 他走了。")
+        self.assertEqual(book.root_chapters[0].lines, ["正文第一段。", "正文第二段。"])
+
     def test_chapter_prefix_in_content_not_heading(self):
         text = """书名：误判测试
 作者：作者
@@ -72,6 +100,22 @@ class TestEpubify(unittest.TestCase):
             text = epubify.read_text(path)
         self.assertIn("书名：测试", text)
 
+    def test_read_text_utf8_bom_and_split_prefix(self):
+        body = "a" * (epubify.ENCODING_SNIFF_BYTES - 1) + "书名：测试\n"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "book.txt"
+            path.write_bytes(body.encode("utf-8"))
+            self.assertEqual(epubify.read_text(path), body)
+            path.write_bytes(codecs.BOM_UTF8 + "书名：测试\n".encode("utf-8"))
+            self.assertEqual(epubify.read_text(path), "书名：测试\n")
+
+    def test_read_text_gb18030_after_ascii_prefix(self):
+        body = "a" * epubify.ENCODING_SNIFF_BYTES + "\n书名：测试\n"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "book.txt"
+            path.write_bytes(body.encode("gb18030"))
+            self.assertEqual(epubify.read_text(path), body)
+
     def test_build_epub_outputs(self):
         text = """书名：测试书
 作者：作者
@@ -94,6 +138,24 @@ class TestEpubify(unittest.TestCase):
                 self.assertTrue(any(name.startswith("OEBPS/text/section_") for name in names))
                 info = zf.getinfo("mimetype")
                 self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(zf.getinfo("OEBPS/content.opf").compress_type, zipfile.ZIP_DEFLATED)
+                self.assertEqual(zf.getinfo("OEBPS/text/section_0002.xhtml").compress_type, zipfile.ZIP_DEFLATED)
+                date_times = {info.date_time for info in zf.infolist()}
+                self.assertEqual(len(date_times), 1)
+                self.assertNotEqual(date_times.pop()[0], 1980)
+
+    def test_parse_args_compresslevel(self):
+        self.assertEqual(epubify.parse_args(["a.txt"]).compresslevel, epubify.DEFAULT_COMPRESSLEVEL)
+        self.assertEqual(epubify.parse_args(["a.txt", "--fast"]).compresslevel, epubify.FAST_COMPRESSLEVEL)
+        self.assertEqual(epubify.parse_args(["a.txt", "--small"]).compresslevel, epubify.SMALL_COMPRESSLEVEL)
+
+    def test_section_paragraphs_written_in_batches(self):
+        lines = [f"第{i}段" for i in range(epubify.SECTION_WRITE_BATCH * 2 + 1)]
+        chapter = epubify.Chapter(title="第一章", lines=lines)
+        chunks = list(epubify.iter_section_bytes(chapter, "zh-CN"))
+        self.assertEqual(len(chunks), 5)
+        body = b"".join(chunks[1:-1]).decode("utf-8")
+        self.assertEqual(body, "".join(f"    <p>{line}</p>\n" for line in lines))
 
     def test_front_matter_in_spine_without_nav(self):
         text = """书名：测试书